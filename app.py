@@ -1,17 +1,27 @@
 import streamlit as st
 import folium
+from folium.plugins import Draw
 from streamlit_folium import st_folium
 import geopandas as gpd
 import pandas as pd
-from shapely.geometry import Point, LineString, Polygon, MultiLineString, MultiPolygon
+import numpy as np
+import shapely
+from pyproj import Geod
+from shapely.geometry import Point, LineString, Polygon, MultiLineString, MultiPolygon, shape
 import tempfile
 import os
 from datetime import datetime
 import math
-from zipfile import ZipFile
+import json
+import shutil
+import sqlite3
+from datetime import timedelta
+from zipfile import ZipFile, ZIP_DEFLATED
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
 import fiona
 from fiona.drvsupport import supported_drivers
+from kml_parallel import parse_kml_parallel
 
 # Enable KML support in fiona
 supported_drivers['KML'] = 'rw'
@@ -27,6 +37,30 @@ st.set_page_config(
 # Konfigurasi path KML master
 KML_MASTER_PATH = "zxcmcnc.kml"
 
+# Konfigurasi penyimpanan riwayat gangguan
+EVENT_DB_PATH = "gangguan_events.db"
+HOTSPOT_GRID_DEG = 0.01  # ukuran grid cell hotspot (~1.1 km)
+
+# Toleransi jarak closure ke kabel untuk asosiasi (meter)
+CLOSURE_CABLE_TOLERANCE_M = 5
+
+# Grid density multi-level: ukuran cell dalam derajat (~0.5 km, ~2 km, ~11 km, ~55 km)
+DENSITY_GRID_LEVELS = [0.005, 0.02, 0.1, 0.5]
+DENSITY_TARGET_FEATURES = 20
+
+# Panjang geodesic (meter) di ellipsoid WGS84, valid lintas zona UTM
+GEOD = Geod(ellps='WGS84')
+
+# Konfigurasi export hasil analisis: format -> (ekstensi, mime)
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FORMATS = {
+    'GeoJSON': ('geojson', 'application/geo+json'),
+    'GeoPackage': ('gpkg', 'application/geopackage+sqlite3'),
+    'KML': ('kml', 'application/vnd.google-earth.kml+xml'),
+    'KMZ': ('kmz', 'application/vnd.google-earth.kmz'),
+    'CSV (WKT)': ('csv', 'text/csv'),
+}
+
 # Initialize session state
 if 'gdf_master' not in st.session_state:
     st.session_state.gdf_master = None
@@ -40,6 +74,18 @@ if 'map_click_data' not in st.session_state:
     st.session_state.map_click_data = None
 if 'last_click_coords' not in st.session_state:
     st.session_state.last_click_coords = None
+if 'query_area' not in st.session_state:
+    st.session_state.query_area = None
+if 'closure_assoc' not in st.session_state:
+    st.session_state.closure_assoc = None
+if 'kml_styles' not in st.session_state:
+    st.session_state.kml_styles = {}
+if 'density_grid' not in st.session_state:
+    st.session_state.density_grid = None
+if 'last_event_id' not in st.session_state:
+    st.session_state.last_event_id = None
+if 'analysis_radius_km' not in st.session_state:
+    st.session_state.analysis_radius_km = None
 
 # Fungsi untuk membaca KML dengan semua metode possible
 def load_kml_comprehensive(file_path):
@@ -110,6 +156,19 @@ def load_kml_comprehensive(file_path):
         st.error(f"❌ Comprehensive KML reading failed: {e}")
         return None
 
+def load_kml_parallel(file_path):
+    """Parse KML paralel per chunk Placemark di semua core"""
+    st.session_state.kml_styles = {}
+    try:
+        gdf, styles = parse_kml_parallel(file_path)
+        st.session_state.kml_styles = styles
+        if not gdf.empty:
+            st.success(f"✅ Parallel parse: {len(gdf)} features, {len(styles)} styles")
+        return gdf
+    except Exception as e:
+        st.warning(f"Parallel parse failed: {e}")
+        return None
+
 def parse_kml_manual(file_path):
     """Manual parsing untuk KML yang kompleks"""
     try:
@@ -212,13 +271,21 @@ def load_master_kml():
             st.error(f"❌ File tidak ditemukan: {KML_MASTER_PATH}")
             return None
         
-        st.info("🔄 Loading KML dengan semua metode...")
-        gdf = load_kml_comprehensive(KML_MASTER_PATH)
+        st.info("🔄 Loading KML (parallel parse)...")
+        gdf = load_kml_parallel(KML_MASTER_PATH)
+        
+        # Fallback ke semua metode jika parallel parse tidak menghasilkan data
+        if gdf is None or gdf.empty:
+            st.info("🔄 Loading KML dengan semua metode...")
+            gdf = load_kml_comprehensive(KML_MASTER_PATH)
         
         if gdf is not None and not gdf.empty:
             # Clean data
             gdf = clean_geometry(gdf)
             
+            # ID asset dihitung sekali, dipakai ulang untuk riwayat, asosiasi & batch export
+            gdf = gdf.assign(feature_id=get_feature_ids(gdf).values)
+            
             # Show detailed info
             st.success(f"📊 Data berhasil dimuat: {len(gdf)} features")
             
@@ -306,6 +373,84 @@ def filter_features_nearby(gdf, center_point, radius_km=5):
         st.error(f"Error filtering: {e}")
         return gpd.GeoDataFrame()
 
+def get_metric_crs(geom):
+    """CRS UTM (meter) untuk lokasi geometry"""
+    return gpd.GeoSeries([geom], crs="EPSG:4326").estimate_utm_crs()
+
+def get_utm_epsg(lon, lat):
+    """Kode EPSG zona UTM WGS84 per koordinat (array)"""
+    zone = np.clip(np.floor((np.asarray(lon) + 180) / 6).astype(int) + 1, 1, 60)
+    return np.where(np.asarray(lat) >= 0, 32600, 32700) + zone
+
+def build_corridor(line_geom, width_m=50):
+    """Buffer polyline menjadi koridor dengan lebar (kiri + kanan) dalam meter"""
+    metric_crs = get_metric_crs(line_geom)
+    line_metric = gpd.GeoSeries([line_geom], crs="EPSG:4326").to_crs(metric_crs)
+    corridor = line_metric.buffer(width_m / 2).to_crs("EPSG:4326")
+    return corridor.iloc[0]
+
+def filter_features_in_area(gdf, area_geom):
+    """Filter features yang intersect dengan poligon/koridor"""
+    try:
+        if gdf is None or gdf.empty or area_geom is None or area_geom.is_empty:
+            return gpd.GeoDataFrame()
+
+        if gdf.crs is None:
+            gdf = gdf.set_crs("EPSG:4326")
+
+        # Spatial index + predicate: cek bbox lalu intersects (prepared) dalam satu call GEOS
+        matches_index = gdf.sindex.query(area_geom, predicate='intersects')
+        area_features = gdf.iloc[sorted(matches_index)].copy()
+
+        if area_features.empty:
+            return area_features
+
+        # Panjang bagian line yang berada di dalam area (meter)
+        metric_crs = get_metric_crs(area_geom)
+        is_line = area_features.geometry.type.isin(['LineString', 'MultiLineString'])
+        panjang = pd.Series(0.0, index=area_features.index)
+        if is_line.any():
+            clipped = area_features.geometry[is_line].intersection(area_geom)
+            panjang[is_line] = clipped.to_crs(metric_crs).length
+        area_features['panjang_potong_meter'] = panjang.round(1)
+
+        # Jarak dari titik tengah area
+        center_point = area_geom.representative_point()
+        area_features['jarak_meter'] = area_features.geometry.apply(
+            lambda geom: center_point.distance(geom) * 111000
+        )
+        area_features = area_features.sort_values('jarak_meter')
+
+        return area_features
+
+    except Exception as e:
+        st.error(f"Error filtering area: {e}")
+        return gpd.GeoDataFrame()
+
+def read_area_upload(uploaded_file):
+    """Membaca poligon/polyline dari file upload (KML, KMZ, GeoJSON)"""
+    suffix = os.path.splitext(uploaded_file.name)[1].lower()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, f"area{suffix}")
+        with open(tmp_path, 'wb') as f:
+            f.write(uploaded_file.getvalue())
+
+        if suffix == '.kmz':
+            with ZipFile(tmp_path) as kmz:
+                kml_names = [n for n in kmz.namelist() if n.lower().endswith('.kml')]
+                if not kml_names:
+                    return None
+                kmz.extract(kml_names[0], tmp_dir)
+                tmp_path = os.path.join(tmp_dir, kml_names[0])
+
+        gdf_area = gpd.read_file(tmp_path)
+
+    if gdf_area.empty:
+        return None
+    if gdf_area.crs is not None:
+        gdf_area = gdf_area.to_crs("EPSG:4326")
+    return gdf_area.geometry.union_all() if hasattr(gdf_area.geometry, 'union_all') else gdf_area.geometry.unary_union
+
 def create_detailed_popup(row):
     """Membuat popup detail"""
     try:
@@ -339,7 +484,24 @@ def create_detailed_popup(row):
     except Exception as e:
         return f"<div>Popup error: {str(e)}</div>"
 
-def create_interactive_map(gdf_nearby, gangguan_coords, zoom=15, radius_km=5, tiles=None):
+def kml_color_to_hex(color):
+    """Warna KML (aabbggrr) -> (#rrggbb, opacity)"""
+    if not isinstance(color, str) or len(color) != 8:
+        return None, None
+    try:
+        opacity = round(int(color[:2], 16) / 255, 2)
+    except ValueError:
+        return None, None
+    return f"#{color[6:8]}{color[4:6]}{color[2:4]}", opacity
+
+def get_kml_style(row, styles):
+    """Style KML hasil parse (line_color, line_width, poly_color, icon_href) untuk satu feature"""
+    style_url = row.get('styleUrl')
+    if not styles or not isinstance(style_url, str):
+        return {}
+    return styles.get(style_url.split('#')[-1], {})
+
+def create_interactive_map(gdf_nearby, gangguan_coords, zoom=15, radius_km=5, tiles=None, query_area=None, draw_mode=None, styles=None):
     """Membuat peta interaktif"""
     try:
         if gangguan_coords:
@@ -354,6 +516,12 @@ def create_interactive_map(gdf_nearby, gangguan_coords, zoom=15, radius_km=5, ti
             m = folium.Map(location=center_loc, zoom_start=zoom, control_scale=True, tiles=tiles)
         m.add_child(folium.LatLngPopup())
         
+        # Tool gambar poligon / polyline untuk query area
+        if draw_mode == 'polygon':
+            Draw(export=False, draw_options={'polyline': False, 'circle': False, 'circlemarker': False, 'marker': False}).add_to(m)
+        elif draw_mode == 'polyline':
+            Draw(export=False, draw_options={'polygon': False, 'rectangle': False, 'circle': False, 'circlemarker': False, 'marker': False}).add_to(m)
+        
         # Instruksi klik
         folium.Marker(
             location=center_loc,
@@ -361,6 +529,14 @@ def create_interactive_map(gdf_nearby, gangguan_coords, zoom=15, radius_km=5, ti
             )
         ).add_to(m)
         
+        # Area pencarian (poligon / koridor)
+        if query_area is not None:
+            folium.GeoJson(
+                query_area.__geo_interface__,
+                style_function=lambda x: {'fillColor': 'red', 'color': 'red', 'weight': 2, 'fillOpacity': 0.1},
+                popup="Area Pencarian"
+            ).add_to(m)
+        
         # Marker gangguan
         if gangguan_coords:
             folium.Marker(
@@ -369,6 +545,7 @@ def create_interactive_map(gdf_nearby, gangguan_coords, zoom=15, radius_km=5, ti
                 icon=folium.Icon(color='red', icon='exclamation-triangle', prefix='fa')
             ).add_to(m)
             
+        if gangguan_coords and query_area is None:
             folium.Circle(
                 location=gangguan_coords,
                 radius=radius_km * 100,
@@ -379,28 +556,50 @@ def create_interactive_map(gdf_nearby, gangguan_coords, zoom=15, radius_km=5, ti
                 popup=f"Area Pencarian ({radius_km} km)"
             ).add_to(m)
         
-        # Tambahkan features
+        # Tambahkan features (pakai Style dari KML jika ada)
         if gdf_nearby is not None and not gdf_nearby.empty:
             for idx, row in gdf_nearby.iterrows():
                 try:
+                    kml_style = get_kml_style(row, styles)
                     if row.geometry.geom_type == 'Point':
+                        if kml_style.get('icon_href'):
+                            icon = folium.CustomIcon(kml_style['icon_href'], icon_size=(24, 24))
+                        else:
+                            icon = folium.Icon(color='blue', icon='info-sign')
                         folium.Marker(
                             location=[row.geometry.y, row.geometry.x],
                             popup=folium.Popup(create_detailed_popup(row), max_width=400),
-                            icon=folium.Icon(color='blue', icon='info-sign')
+                            icon=icon
                         ).add_to(m)
                     
                     elif row.geometry.geom_type in ['LineString', 'MultiLineString']:
+                        line_color, line_opacity = kml_color_to_hex(kml_style.get('line_color'))
+                        try:
+                            line_width = float(kml_style.get('line_width', 4))
+                        except ValueError:
+                            line_width = 4
+                        line_style = {
+                            'color': line_color or 'green',
+                            'weight': line_width,
+                            'opacity': line_opacity if line_opacity is not None else 0.8
+                        }
                         folium.GeoJson(
                             row.geometry.__geo_interface__,
-                            style_function=lambda x: {'color': 'green', 'weight': 4, 'opacity': 0.8},
+                            style_function=lambda x, line_style=line_style: line_style,
                             popup=folium.Popup(create_detailed_popup(row), max_width=400)
                         ).add_to(m)
                     
                     elif row.geometry.geom_type in ['Polygon', 'MultiPolygon']:
+                        poly_color, poly_opacity = kml_color_to_hex(kml_style.get('poly_color'))
+                        poly_style = {
+                            'fillColor': poly_color or 'orange',
+                            'color': poly_color or 'orange',
+                            'weight': 2,
+                            'fillOpacity': poly_opacity if poly_opacity is not None else 0.3
+                        }
                         folium.GeoJson(
                             row.geometry.__geo_interface__,
-                            style_function=lambda x: {'fillColor': 'orange', 'color': 'orange', 'weight': 2, 'fillOpacity': 0.3},
+                            style_function=lambda x, poly_style=poly_style: poly_style,
                             popup=folium.Popup(create_detailed_popup(row), max_width=400)
                         ).add_to(m)
                         
@@ -413,37 +612,71 @@ def create_interactive_map(gdf_nearby, gangguan_coords, zoom=15, radius_km=5, ti
         st.error(f"Map creation error: {e}")
         return folium.Map(location=[-6.2, 106.8], zoom_start=10)
 
-def analyze_from_map_click(click_data, radius_km):
+def resolve_radius(lat, lon, radius_km):
+    """Radius yang dipakai analisis: saran density grid jika radius otomatis aktif"""
+    if st.session_state.get('auto_radius') and st.session_state.get('density_grid'):
+        suggested_km, _ = suggest_radius(
+            st.session_state.density_grid, lat, lon,
+            target=st.session_state.get('density_target', DENSITY_TARGET_FEATURES)
+        )
+        if suggested_km is not None:
+            return suggested_km
+    return radius_km
+
+def analyze_radius(lat, lon, radius_km, mode, source_col=None, folder_col=None):
+    """Analisis radius di satu titik: filter, apply sidebar filters, asosiasi, simpan riwayat"""
+    # Analisis ulang di titik yang sama (mis. saran radius) = kejadian yang sama, event-nya diperbarui
+    rerun_event_id = None
+    if st.session_state.query_area is None and st.session_state.gangguan_coords == [lat, lon]:
+        rerun_event_id = st.session_state.last_event_id
+
+    st.session_state.gangguan_coords = [lat, lon]
+    st.session_state.query_area = None
+    st.session_state.analysis_done = True
+    st.session_state.analysis_radius_km = radius_km
+
+    gangguan_point = Point(lon, lat)
+
+    with st.spinner(f"Mencari features dalam radius {radius_km} km..."):
+        st.session_state.gdf_nearby = filter_features_nearby(
+            st.session_state.gdf_master,
+            gangguan_point,
+            radius_km
+        )
+    # Apply filters from sidebar
+    try:
+        st.session_state.gdf_nearby = apply_filters(
+            st.session_state.gdf_nearby,
+            st.session_state.get('name_filter', ''),
+            st.session_state.get('name_list', []),
+            source_col,
+            st.session_state.get('source_filter', []),
+            folder_col_name=folder_col,
+            folder_filter_vals=st.session_state.get('folder_filter', [])
+        )
+    except Exception:
+        pass
+
+    st.session_state.gdf_nearby = attach_closure_associations(st.session_state.gdf_nearby, st.session_state.closure_assoc)
+    st.session_state.last_event_id = record_analysis_event(
+        st.session_state.gdf_nearby, [lat, lon], radius_km=radius_km, mode=mode, event_id=rerun_event_id
+    )
+
+def apply_suggested_radius(radius_km, source_col=None, folder_col=None):
+    """Callback tombol saran radius: set slider lalu ulangi analisis di lokasi yang sama"""
+    st.session_state.radius_input = radius_km
+    if st.session_state.gangguan_coords:
+        lat, lon = st.session_state.gangguan_coords
+        analyze_radius(lat, lon, radius_km, 'saran', source_col, folder_col)
+
+def analyze_from_map_click(click_data, radius_km, source_col=None, folder_col=None):
     """Analisis dari klik peta"""
     try:
         if click_data and 'lat' in click_data and 'lng' in click_data:
             lat = click_data['lat']
             lng = click_data['lng']
             
-            st.session_state.gangguan_coords = [lat, lng]
-            st.session_state.analysis_done = True
-            
-            gangguan_point = Point(lng, lat)
-            
-            with st.spinner(f"Mencari features dalam radius {radius_km} km..."):
-                st.session_state.gdf_nearby = filter_features_nearby(
-                    st.session_state.gdf_master, 
-                    gangguan_point, 
-                    radius_km
-                )
-            # Apply filters from sidebar
-            try:
-                st.session_state.gdf_nearby = apply_filters(
-                    st.session_state.gdf_nearby,
-                    st.session_state.get('name_filter', ''),
-                    st.session_state.get('name_list', []),
-                    locals().get('source_col', None),
-                    st.session_state.get('source_filter', []),
-                    folder_col_name=locals().get('folder_col', None),
-                    folder_filter_vals=st.session_state.get('folder_filter', [])
-                )
-            except Exception:
-                pass
+            analyze_radius(lat, lng, resolve_radius(lat, lng, radius_km), 'klik', source_col, folder_col)
             
             return True
         return False
@@ -451,6 +684,45 @@ def analyze_from_map_click(click_data, radius_km):
         st.error(f"Analysis error: {e}")
         return False
 
+def analyze_area(area_geom, source_col=None, folder_col=None):
+    """Analisis features di dalam poligon / koridor"""
+    try:
+        if area_geom is None or area_geom.is_empty:
+            return False
+
+        center = area_geom.representative_point()
+        st.session_state.query_area = area_geom
+        st.session_state.gangguan_coords = [center.y, center.x]
+        st.session_state.analysis_done = True
+        st.session_state.analysis_radius_km = None
+
+        with st.spinner("Mencari features di dalam area..."):
+            st.session_state.gdf_nearby = filter_features_in_area(
+                st.session_state.gdf_master,
+                area_geom
+            )
+        # Apply filters from sidebar
+        try:
+            st.session_state.gdf_nearby = apply_filters(
+                st.session_state.gdf_nearby,
+                st.session_state.get('name_filter', ''),
+                st.session_state.get('name_list', []),
+                source_col,
+                st.session_state.get('source_filter', []),
+                folder_col_name=folder_col,
+                folder_filter_vals=st.session_state.get('folder_filter', [])
+            )
+        except Exception:
+            pass
+
+        st.session_state.gdf_nearby = attach_closure_associations(st.session_state.gdf_nearby, st.session_state.closure_assoc)
+        st.session_state.last_event_id = record_analysis_event(st.session_state.gdf_nearby, st.session_state.gangguan_coords, mode='area', area_geom=area_geom)
+
+        return True
+    except Exception as e:
+        st.error(f"Area analysis error: {e}")
+        return False
+
 
 def apply_filters(gdf, name_filter_text, name_exact_list, source_col_name, source_filter_list, folder_col_name=None, folder_filter_vals=None):
     """Apply name substring, exact name list and source layer filters to a GeoDataFrame."""
@@ -501,6 +773,753 @@ def apply_filters(gdf, name_filter_text, name_exact_list, source_col_name, sourc
 
     return out
 
+def parse_description(desc):
+    """Parse atribut 'key : value' dari description KML"""
+    attrs = {}
+    if not isinstance(desc, str):
+        return attrs
+    for line in desc.splitlines():
+        if ':' in line:
+            key, value = line.split(':', 1)
+            attrs[key.strip()] = value.strip()
+    return attrs
+
+def get_feature_ids(gdf):
+    """ID asset per feature dari description, fallback ke id Placemark / index
+
+    Pakai kolom feature_id yang dihitung sekali saat load; dihitung ulang hanya jika kolom belum ada."""
+    if 'feature_id' in gdf.columns:
+        return gdf['feature_id']
+    descriptions = gdf['description'] if 'description' in gdf.columns else [None] * len(gdf)
+    placemark_ids = gdf['id'] if 'id' in gdf.columns else [None] * len(gdf)
+    feature_ids = []
+    for idx, desc, placemark_id in zip(gdf.index, descriptions, placemark_ids):
+        asset_id = parse_description(desc).get('id')
+        if asset_id:
+            feature_ids.append(asset_id)
+        elif pd.notna(placemark_id) and placemark_id not in ['', None]:
+            feature_ids.append(str(placemark_id))
+        else:
+            feature_ids.append(str(idx))
+    return pd.Series(feature_ids, index=gdf.index, dtype=object)
+
+def get_feature_names(gdf):
+    """Nama per feature: kolom 'name' pertama yang terisi, None jika tidak ada"""
+    name_cols = [c for c in gdf.columns if 'name' in c.lower()]
+    if not name_cols:
+        return pd.Series(None, index=gdf.index, dtype=object)
+    names = gdf[name_cols].astype(object).bfill(axis=1).iloc[:, 0]
+    return names.map(lambda name: str(name) if pd.notna(name) else None)
+
+def get_grid_cell(lat, lon, cell_deg=HOTSPOT_GRID_DEG):
+    """ID grid cell untuk koordinat"""
+    return f"{math.floor(lat / cell_deg)}_{math.floor(lon / cell_deg)}"
+
+EVENT_STORE_VERSION = 1
+LINE_TYPES_SQL = "('LineString', 'MultiLineString')"
+ROLLUP_TABLES = ['rollup_kabel', 'rollup_span', 'rollup_grid']
+ROLLUP_GRAINS = [('d', 10), ('m', 7)]  # bucket = prefix created_at: 'YYYY-MM-DD' / 'YYYY-MM'
+
+def init_event_store(db_path=EVENT_DB_PATH):
+    """Membuat tabel riwayat gangguan + R*Tree index + rollup hotspot jika belum ada"""
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                lat REAL NOT NULL,
+                lon REAL NOT NULL,
+                radius_km REAL,
+                mode TEXT,
+                grid_cell TEXT,
+                feature_count INTEGER
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree USING rtree(
+                id, min_lon, max_lon, min_lat, max_lat
+            );
+            CREATE TABLE IF NOT EXISTS event_features (
+                event_id INTEGER NOT NULL REFERENCES events(id),
+                created_at TEXT NOT NULL,
+                feature_id TEXT NOT NULL,
+                name TEXT,
+                geom_type TEXT,
+                span TEXT,
+                ring_id TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_events_time_cell ON events(created_at, grid_cell);
+            CREATE INDEX IF NOT EXISTS idx_ef_time_feature ON event_features(created_at, feature_id);
+            CREATE INDEX IF NOT EXISTS idx_ef_time_span ON event_features(created_at, span);
+            CREATE INDEX IF NOT EXISTS idx_ef_event ON event_features(event_id);
+
+            -- Rollup jumlah event per kabel / span / grid cell, per hari (grain 'd') dan per bulan (grain 'm')
+            CREATE TABLE IF NOT EXISTS rollup_kabel (
+                grain TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                feature_id TEXT NOT NULL,
+                name TEXT,
+                span TEXT,
+                ring_id TEXT,
+                event_count INTEGER NOT NULL,
+                last_at TEXT,
+                PRIMARY KEY (grain, bucket, feature_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rollup_span (
+                grain TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                span TEXT NOT NULL,
+                ring_id TEXT,
+                event_count INTEGER NOT NULL,
+                last_at TEXT,
+                PRIMARY KEY (grain, bucket, span)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS rollup_grid (
+                grain TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                grid_cell TEXT NOT NULL,
+                event_count INTEGER NOT NULL,
+                lat_sum REAL NOT NULL,
+                lon_sum REAL NOT NULL,
+                last_at TEXT,
+                PRIMARY KEY (grain, bucket, grid_cell)
+            ) WITHOUT ROWID;
+        """)
+
+        # Store lama (sebelum ada rollup): isi rollup sekali dari tabel mentah
+        if conn.execute("PRAGMA user_version").fetchone()[0] < EVENT_STORE_VERSION:
+            for table in ROLLUP_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+            _update_event_rollups(conn, None, 1)
+            conn.execute(f"PRAGMA user_version = {EVENT_STORE_VERSION}")
+
+def _update_event_rollups(conn, event_id, delta):
+    """Tambah (delta=1) atau kurangi (delta=-1) kontribusi satu event di rollup harian & bulanan
+
+    event_id=None (hanya delta=1) mengisi rollup dari semua event sekaligus."""
+    event_filter = "1" if event_id is None else "event_id = :event_id"
+    event_row_filter = "1" if event_id is None else "id = :event_id"
+    for grain, width in ROLLUP_GRAINS:
+        args = {'grain': grain, 'width': width, 'event_id': event_id}
+        if delta > 0:
+            conn.execute(f"""
+                INSERT INTO rollup_kabel (grain, bucket, feature_id, name, span, ring_id, event_count, last_at)
+                SELECT :grain, substr(created_at, 1, :width) AS bucket, feature_id, MAX(name), MAX(span), MAX(ring_id),
+                       COUNT(DISTINCT event_id), MAX(created_at)
+                FROM event_features WHERE {event_filter} AND geom_type IN {LINE_TYPES_SQL}
+                GROUP BY bucket, feature_id
+                ON CONFLICT (grain, bucket, feature_id) DO UPDATE SET
+                    event_count = event_count + excluded.event_count,
+                    name = COALESCE(excluded.name, name),
+                    span = COALESCE(excluded.span, span),
+                    ring_id = COALESCE(excluded.ring_id, ring_id),
+                    last_at = MAX(last_at, excluded.last_at)
+            """, args)
+            conn.execute(f"""
+                INSERT INTO rollup_span (grain, bucket, span, ring_id, event_count, last_at)
+                SELECT :grain, substr(created_at, 1, :width) AS bucket, span, MAX(ring_id), COUNT(DISTINCT event_id), MAX(created_at)
+                FROM event_features WHERE {event_filter} AND span IS NOT NULL
+                GROUP BY bucket, span
+                ON CONFLICT (grain, bucket, span) DO UPDATE SET
+                    event_count = event_count + excluded.event_count,
+                    ring_id = COALESCE(excluded.ring_id, ring_id),
+                    last_at = MAX(last_at, excluded.last_at)
+            """, args)
+            conn.execute(f"""
+                INSERT INTO rollup_grid (grain, bucket, grid_cell, event_count, lat_sum, lon_sum, last_at)
+                SELECT :grain, substr(created_at, 1, :width) AS bucket, grid_cell, COUNT(*), SUM(lat), SUM(lon), MAX(created_at)
+                FROM events WHERE {event_row_filter}
+                GROUP BY bucket, grid_cell
+                ON CONFLICT (grain, bucket, grid_cell) DO UPDATE SET
+                    event_count = event_count + excluded.event_count,
+                    lat_sum = lat_sum + excluded.lat_sum,
+                    lon_sum = lon_sum + excluded.lon_sum,
+                    last_at = MAX(last_at, excluded.last_at)
+            """, args)
+        else:
+            conn.execute(f"""
+                UPDATE rollup_kabel SET event_count = event_count - 1
+                WHERE (grain, bucket, feature_id) IN (
+                    SELECT DISTINCT :grain, substr(created_at, 1, :width), feature_id
+                    FROM event_features WHERE event_id = :event_id AND geom_type IN {LINE_TYPES_SQL}
+                )
+            """, args)
+            conn.execute("""
+                UPDATE rollup_span SET event_count = event_count - 1
+                WHERE (grain, bucket, span) IN (
+                    SELECT DISTINCT :grain, substr(created_at, 1, :width), span
+                    FROM event_features WHERE event_id = :event_id AND span IS NOT NULL
+                )
+            """, args)
+            conn.execute("""
+                UPDATE rollup_grid SET
+                    event_count = event_count - 1,
+                    lat_sum = lat_sum - (SELECT lat FROM events WHERE id = :event_id),
+                    lon_sum = lon_sum - (SELECT lon FROM events WHERE id = :event_id)
+                WHERE (grain, bucket, grid_cell) IN (
+                    SELECT :grain, substr(created_at, 1, :width), grid_cell FROM events WHERE id = :event_id
+                )
+            """, args)
+    if delta < 0:
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE event_count <= 0")
+
+def record_analysis_event(gdf_nearby, coords, radius_km=None, mode='radius', area_geom=None, event_id=None, db_path=EVENT_DB_PATH):
+    """Simpan hasil analisis (lokasi, waktu, radius, feature & ring_id) ke SQLite
+
+    Jika event_id diberikan (analisis ulang kejadian yang sama), event itu diperbarui
+    alih-alih menambah kejadian baru."""
+    try:
+        init_event_store(db_path)
+        lat, lon = coords
+        created_at = datetime.now().isoformat(timespec='seconds')
+        feature_count = 0 if gdf_nearby is None else len(gdf_nearby)
+
+        if area_geom is not None:
+            min_lon, min_lat, max_lon, max_lat = area_geom.bounds
+        else:
+            # Event radius disimpan sebagai titik (lokasi gangguan), bukan extent radius pencarian
+            min_lon, min_lat, max_lon, max_lat = lon, lat, lon, lat
+
+        with sqlite3.connect(db_path) as conn:
+            existing = None
+            if event_id is not None:
+                existing = conn.execute("SELECT created_at FROM events WHERE id = ?", (event_id,)).fetchone()
+
+            if existing:
+                # Waktu kejadian tetap; rollup lama dikurangi lalu feature diganti
+                created_at = existing[0]
+                _update_event_rollups(conn, event_id, -1)
+                conn.execute("DELETE FROM event_features WHERE event_id = ?", (event_id,))
+                conn.execute(
+                    "UPDATE events SET lat = ?, lon = ?, radius_km = ?, mode = ?, grid_cell = ?, feature_count = ? WHERE id = ?",
+                    (lat, lon, radius_km, mode, get_grid_cell(lat, lon), feature_count, event_id)
+                )
+                conn.execute(
+                    "UPDATE events_rtree SET min_lon = ?, max_lon = ?, min_lat = ?, max_lat = ? WHERE id = ?",
+                    (min_lon, max_lon, min_lat, max_lat, event_id)
+                )
+            else:
+                cur = conn.execute(
+                    "INSERT INTO events (created_at, lat, lon, radius_km, mode, grid_cell, feature_count) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (created_at, lat, lon, radius_km, mode, get_grid_cell(lat, lon), feature_count)
+                )
+                event_id = cur.lastrowid
+                conn.execute(
+                    "INSERT INTO events_rtree (id, min_lon, max_lon, min_lat, max_lat) VALUES (?, ?, ?, ?, ?)",
+                    (event_id, min_lon, max_lon, min_lat, max_lat)
+                )
+
+            if feature_count:
+                descriptions = gdf_nearby['description'] if 'description' in gdf_nearby.columns else [None] * feature_count
+                rows = []
+                for feature_id, name, geom_type, desc in zip(
+                    get_feature_ids(gdf_nearby), get_feature_names(gdf_nearby), gdf_nearby.geometry.geom_type, descriptions
+                ):
+                    attrs = parse_description(desc)
+                    rows.append((event_id, created_at, feature_id, name, geom_type, attrs.get('span'), attrs.get('ring_id')))
+                conn.executemany(
+                    "INSERT INTO event_features (event_id, created_at, feature_id, name, geom_type, span, ring_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            _update_event_rollups(conn, event_id, 1)
+        return event_id
+    except Exception as e:
+        st.warning(f"Gagal menyimpan riwayat gangguan: {e}")
+        return None
+
+def get_events_nearby(lat, lon, radius_km, exclude_event_id=None, db_path=EVENT_DB_PATH):
+    """Riwayat gangguan di sekitar lokasi (query lewat R*Tree), tanpa event yang sedang ditampilkan"""
+    buffer_degrees = radius_km / 111
+    bounds = (lon - buffer_degrees, lat - buffer_degrees, lon + buffer_degrees, lat + buffer_degrees)
+    return get_events_in_bounds(bounds, exclude_event_id, db_path)
+
+def get_events_in_bounds(bounds, exclude_event_id=None, db_path=EVENT_DB_PATH):
+    """Riwayat gangguan yang bbox-nya overlap dengan (min_lon, min_lat, max_lon, max_lat)"""
+    if not os.path.exists(db_path):
+        return pd.DataFrame()
+    min_lon, min_lat, max_lon, max_lat = bounds
+    with sqlite3.connect(db_path) as conn:
+        return pd.read_sql_query("""
+            SELECT e.id, e.created_at, e.lat, e.lon, e.radius_km, e.mode, e.feature_count
+            FROM events_rtree r JOIN events e ON e.id = r.id
+            WHERE r.max_lon >= ? AND r.min_lon <= ? AND r.max_lat >= ? AND r.min_lat <= ?
+              AND e.id != ?
+            ORDER BY e.created_at DESC
+        """, conn, params=(min_lon, max_lon, min_lat, max_lat,
+                             -1 if exclude_event_id is None else exclude_event_id))
+
+def get_recent_events(limit=50, db_path=EVENT_DB_PATH):
+    """Daftar analisis terakhir dari riwayat gangguan"""
+    if not os.path.exists(db_path):
+        return pd.DataFrame()
+    with sqlite3.connect(db_path) as conn:
+        return pd.read_sql_query("""
+            SELECT id, created_at, lat, lon, radius_km, mode, feature_count
+            FROM events ORDER BY created_at DESC, id DESC LIMIT ?
+        """, conn, params=(limit,))
+
+def get_event_feature_ids(event_ids, db_path=EVENT_DB_PATH):
+    """Feature id yang cocok per analysis event: {event_id: [feature_id, ...]}"""
+    if not event_ids or not os.path.exists(db_path):
+        return {}
+    placeholders = ",".join("?" * len(event_ids))
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT event_id, feature_id FROM event_features WHERE event_id IN ({placeholders})",
+            list(event_ids)
+        ).fetchall()
+    result = {event_id: [] for event_id in event_ids}
+    for event_id, feature_id in rows:
+        result[event_id].append(feature_id)
+    return result
+
+def get_hotspots(group_by='kabel', days=30, limit=20, db_path=EVENT_DB_PATH):
+    """Hotspot gangguan berulang per kabel, span atau grid cell dalam jendela waktu
+
+    Dibaca dari rollup: bulan penuh di dalam jendela dari rollup bulanan, sisa hari di awal jendela dari rollup harian."""
+    if not os.path.exists(db_path):
+        return pd.DataFrame()
+    init_event_store(db_path)
+    since = (datetime.now() - timedelta(days=days)).date()
+    first_month = since.replace(day=1)
+    if first_month < since:
+        first_month = (first_month + timedelta(days=32)).replace(day=1)
+    rollup_rows = """
+        WHERE (grain = 'd' AND bucket >= ? AND bucket < ?) OR (grain = 'm' AND bucket >= ?)
+    """
+    params = (since.isoformat(), first_month.isoformat(), first_month.isoformat()[:7], limit)
+
+    if group_by == 'kabel':
+        query = f"""
+            SELECT feature_id, MAX(name) AS name, MAX(span) AS span, MAX(ring_id) AS ring_id,
+                   SUM(event_count) AS jumlah_gangguan, MAX(last_at) AS terakhir
+            FROM rollup_kabel {rollup_rows}
+            GROUP BY feature_id
+            ORDER BY jumlah_gangguan DESC LIMIT ?
+        """
+    elif group_by == 'span':
+        query = f"""
+            SELECT span, MAX(ring_id) AS ring_id,
+                   SUM(event_count) AS jumlah_gangguan, MAX(last_at) AS terakhir
+            FROM rollup_span {rollup_rows}
+            GROUP BY span
+            ORDER BY jumlah_gangguan DESC LIMIT ?
+        """
+    else:
+        query = f"""
+            SELECT grid_cell, SUM(lat_sum) / SUM(event_count) AS lat, SUM(lon_sum) / SUM(event_count) AS lon,
+                   SUM(event_count) AS jumlah_gangguan, MAX(last_at) AS terakhir
+            FROM rollup_grid {rollup_rows}
+            GROUP BY grid_cell
+            ORDER BY jumlah_gangguan DESC LIMIT ?
+        """
+    with sqlite3.connect(db_path) as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def build_closure_cable_index(gdf, tolerance_m=CLOSURE_CABLE_TOLERANCE_M):
+    """Spatial join closure (Point) ke kabel (LineString) sekali saat load"""
+    empty = {'table': pd.DataFrame(), 'cable_to_closures': {}, 'closure_to_cables': {}}
+    try:
+        if gdf is None or gdf.empty:
+            return empty
+
+        gdf = gdf.set_crs("EPSG:4326") if gdf.crs is None else gdf.to_crs("EPSG:4326")
+        closures = gdf[gdf.geometry.type == 'Point']
+        cables = gdf[gdf.geometry.type.isin(['LineString', 'MultiLineString'])]
+        if closures.empty or cables.empty:
+            return empty
+
+        # Kandidat point-on-line: buffer closure dengan toleransi dalam derajat (dibulatkan ke atas per lintang)
+        closure_lat = closures.geometry.y.values
+        tolerance_deg = tolerance_m / (110000 * np.maximum(np.cos(np.radians(closure_lat)), 0.01))
+        closure_pos, cable_pos = cables.sindex.query(
+            shapely.buffer(np.asarray(closures.geometry.values), tolerance_deg), predicate='intersects'
+        )
+
+        # Jarak pasti di zona UTM masing-masing closure (data nasional mencakup banyak zona)
+        pair_epsg = get_utm_epsg(closures.geometry.x.values, closure_lat)[closure_pos]
+        jarak = np.empty(len(closure_pos))
+        for epsg in np.unique(pair_epsg):
+            in_zone = pair_epsg == epsg
+            closure_geoms = gpd.GeoSeries(closures.geometry.values[closure_pos[in_zone]], crs="EPSG:4326").to_crs(epsg)
+            cable_geoms = gpd.GeoSeries(cables.geometry.values[cable_pos[in_zone]], crs="EPSG:4326").to_crs(epsg)
+            jarak[in_zone] = closure_geoms.distance(cable_geoms, align=False).values
+        within = jarak <= tolerance_m
+        closure_pos, cable_pos, jarak = closure_pos[within], cable_pos[within], jarak[within]
+
+        closure_ids = get_feature_ids(closures).tolist()
+        closure_names = get_feature_names(closures).tolist()
+        cable_ids = get_feature_ids(cables).tolist()
+        cable_names = get_feature_names(cables).tolist()
+
+        table = pd.DataFrame({
+            'closure_id': [closure_ids[i] for i in closure_pos],
+            'closure_name': [closure_names[i] for i in closure_pos],
+            'cable_id': [cable_ids[i] for i in cable_pos],
+            'cable_name': [cable_names[i] for i in cable_pos],
+            'jarak_meter': jarak.round(2)
+        })
+        if table.empty:
+            return empty
+        table = table.sort_values('jarak_meter').drop_duplicates(subset=['closure_id', 'cable_id'])
+        table = table.sort_values(['cable_name', 'closure_name']).reset_index(drop=True)
+
+        # Index dua arah untuk lookup instan
+        cable_to_closures = table.groupby('cable_id')['closure_name'].apply(lambda x: sorted(set(x.dropna()))).to_dict()
+        closure_to_cables = table.groupby('closure_id')['cable_name'].apply(lambda x: sorted(set(x.dropna()))).to_dict()
+
+        return {'table': table, 'cable_to_closures': cable_to_closures, 'closure_to_cables': closure_to_cables}
+
+    except Exception as e:
+        st.warning(f"Asosiasi kabel-closure gagal dibuat: {e}")
+        return empty
+
+def attach_closure_associations(gdf, assoc):
+    """Tambah kolom 'closure pada kabel' / 'kabel di closure' dari index asosiasi"""
+    if gdf is None or gdf.empty or not assoc:
+        return gdf
+
+    out = gdf.copy()
+    closures_on_cable = []
+    cables_at_closure = []
+    for fid, geom_type in zip(get_feature_ids(out), out.geometry.geom_type):
+        if geom_type in ['LineString', 'MultiLineString']:
+            closures_on_cable.append(", ".join(assoc['cable_to_closures'].get(fid, [])))
+            cables_at_closure.append("")
+        elif geom_type == 'Point':
+            closures_on_cable.append("")
+            cables_at_closure.append(", ".join(assoc['closure_to_cables'].get(fid, [])))
+        else:
+            closures_on_cable.append("")
+            cables_at_closure.append("")
+
+    out['closure_pada_kabel'] = closures_on_cable
+    out['kabel_di_closure'] = cables_at_closure
+    return out
+
+def geometry_to_kml(geom):
+    """Konversi shapely geometry ke elemen geometry KML"""
+    def coords_text(coords):
+        return " ".join(f"{c[0]},{c[1]}" for c in coords)
+
+    if geom is None or geom.is_empty:
+        return ""
+    if geom.geom_type == 'Point':
+        return f"<Point><coordinates>{geom.x},{geom.y}</coordinates></Point>"
+    if geom.geom_type == 'LineString':
+        return f"<LineString><tessellate>1</tessellate><coordinates>{coords_text(geom.coords)}</coordinates></LineString>"
+    if geom.geom_type == 'Polygon':
+        inner = "".join(
+            f"<innerBoundaryIs><LinearRing><coordinates>{coords_text(ring.coords)}</coordinates></LinearRing></innerBoundaryIs>"
+            for ring in geom.interiors
+        )
+        return (f"<Polygon><outerBoundaryIs><LinearRing><coordinates>{coords_text(geom.exterior.coords)}</coordinates>"
+                f"</LinearRing></outerBoundaryIs>{inner}</Polygon>")
+    # Multi* / GeometryCollection
+    return "<MultiGeometry>" + "".join(geometry_to_kml(part) for part in geom.geoms) + "</MultiGeometry>"
+
+def _iter_export_chunks(gdf, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(gdf), chunk_rows):
+        yield gdf.iloc[start:start + chunk_rows]
+
+def _write_csv_wkt(layers, out):
+    header = True
+    for layer_name, gdf in layers:
+        for chunk in _iter_export_chunks(gdf):
+            df = pd.DataFrame(chunk.drop(columns='geometry'))
+            if len(layers) > 1:
+                df.insert(0, 'analisis', layer_name)
+            df['geometry_wkt'] = chunk.geometry.to_wkt()
+            out.write(df.to_csv(index=False, header=header).encode('utf-8'))
+            header = False
+
+def _write_geojson(layers, out):
+    out.write(b'{"type": "FeatureCollection", "features": [\n')
+    first = True
+    for layer_name, gdf in layers:
+        for chunk in _iter_export_chunks(gdf):
+            for feature in chunk.iterfeatures(na='null'):
+                if len(layers) > 1:
+                    feature['properties']['analisis'] = layer_name
+                if not first:
+                    out.write(b',\n')
+                out.write(json.dumps(feature, default=str).encode('utf-8'))
+                first = False
+    out.write(b'\n]}\n')
+
+def _write_kml(layers, out):
+    out.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n')
+    out.write(b'<name>Hasil Analisis Gangguan</name>\n')
+    out.write(b'<Style id="kabel"><LineStyle><color>ff00aa00</color><width>4</width></LineStyle>'
+              b'<PolyStyle><color>4d0080ff</color></PolyStyle></Style>\n')
+    out.write(b'<Style id="titik"><IconStyle><Icon><href>http://maps.google.com/mapfiles/kml/paddle/blu-circle.png</href></Icon></IconStyle></Style>\n')
+    for layer_name, gdf in layers:
+        name_cols = [c for c in gdf.columns if 'name' in c.lower()]
+        out.write(f"<Folder><name>{escape(str(layer_name))}</name>\n".encode('utf-8'))
+        for chunk in _iter_export_chunks(gdf):
+            parts = []
+            for idx, row in chunk.iterrows():
+                name = next((str(row[c]) for c in name_cols if pd.notna(row[c])), str(idx))
+                style = 'titik' if row.geometry.geom_type in ['Point', 'MultiPoint'] else 'kabel'
+                data = "".join(
+                    f"<Data name={quoteattr(str(col))}><value>{escape(str(row[col]))}</value></Data>"
+                    for col in chunk.columns
+                    if col != 'geometry' and pd.notna(row[col]) and row[col] not in ['', None]
+                )
+                parts.append(
+                    f"<Placemark><name>{escape(name)}</name><styleUrl>#{style}</styleUrl>"
+                    f"<ExtendedData>{data}</ExtendedData>{geometry_to_kml(row.geometry)}</Placemark>\n"
+                )
+            out.write("".join(parts).encode('utf-8'))
+        out.write(b"</Folder>\n")
+    out.write(b"</Document></kml>\n")
+
+def export_layers(layers, fmt):
+    """Export [(nama_layer, GeoDataFrame), ...] ke file sementara secara bertahap per chunk
+
+    Return file read-only (BufferedReader) yang bisa langsung dipakai st.download_button."""
+    fd, export_path = tempfile.mkstemp(suffix=f".{EXPORT_FORMATS[fmt][0]}" if fmt in EXPORT_FORMATS else "")
+    with open(fd, 'w+b') as out:
+        if fmt == 'CSV (WKT)':
+            _write_csv_wkt(layers, out)
+        elif fmt == 'GeoJSON':
+            _write_geojson(layers, out)
+        elif fmt == 'KML':
+            _write_kml(layers, out)
+        elif fmt == 'KMZ':
+            with tempfile.TemporaryFile() as kml_tmp:
+                _write_kml(layers, kml_tmp)
+                kml_tmp.seek(0)
+                with ZipFile(out, 'w', compression=ZIP_DEFLATED) as kmz, kmz.open('doc.kml', 'w') as doc:
+                    shutil.copyfileobj(kml_tmp, doc)
+        elif fmt == 'GeoPackage':
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                gpkg_path = os.path.join(tmp_dir, 'export.gpkg')
+                for layer_name, gdf in layers:
+                    layer = "".join(c if c.isalnum() else "_" for c in str(layer_name))
+                    for i, chunk in enumerate(_iter_export_chunks(gdf)):
+                        chunk.to_file(gpkg_path, layer=layer, driver='GPKG', mode='w' if i == 0 else 'a', geometry_type='Unknown')
+                if os.path.exists(gpkg_path):
+                    with open(gpkg_path, 'rb') as f:
+                        shutil.copyfileobj(f, out)
+        else:
+            os.remove(export_path)
+            raise ValueError(f"Format export tidak dikenal: {fmt}")
+
+    result = open(export_path, 'rb')
+    try:
+        # File tetap bisa dibaca lewat handle yang terbuka; hapus entry-nya supaya tidak menumpuk
+        os.remove(export_path)
+    except OSError:
+        pass
+    return result
+
+def select_features_by_ids(gdf, feature_ids):
+    """Ambil features master berdasarkan feature id (untuk export ulang analisis lama)"""
+    if gdf is None or gdf.empty or not feature_ids:
+        return gpd.GeoDataFrame()
+    return gdf[get_feature_ids(gdf).isin(feature_ids)]
+
+def build_event_layer(gdf, feature_ids, coords, assoc=None):
+    """Layer export untuk analysis event lama: kolom jarak_meter & asosiasi closure seperti export analisis tunggal"""
+    selected = select_features_by_ids(gdf, feature_ids)
+    if selected.empty:
+        return selected
+    lat, lon = coords
+    selected = selected.copy()
+    selected['jarak_meter'] = selected.geometry.distance(Point(lon, lat)) * 111000
+    selected = selected.sort_values('jarak_meter')
+    return attach_closure_associations(selected, assoc)
+
+def _line_segments(line_geoms):
+    """Semua segmen line sebagai array x0, y0, x1, y1 + posisi line asalnya"""
+    parts, part_line = shapely.get_parts(line_geoms, return_index=True)
+    coords, coord_part = shapely.get_coordinates(parts, return_index=True)
+    same_part = coord_part[1:] == coord_part[:-1]
+    start, end = coords[:-1][same_part], coords[1:][same_part]
+    return start[:, 0], start[:, 1], end[:, 0], end[:, 1], part_line[coord_part[:-1][same_part]]
+
+def _split_segments_at_grid(x0, y0, x1, y1, size):
+    """Potong segmen di setiap garis grid yang dilewatinya; tiap potongan berada di satu cell
+
+    Jumlah potongan sebanding dengan panjang line / ukuran cell, bukan luas bbox."""
+    n = len(x0)
+    t_parts, seg_parts = [np.zeros(n), np.ones(n)], [np.arange(n), np.arange(n)]
+    for a0, a1 in [(x0, x1), (y0, y1)]:
+        c0, c1 = np.floor(a0 / size), np.floor(a1 / size)
+        crossings = np.abs(c1 - c0).astype(int)
+        seg = np.repeat(np.arange(n), crossings)
+        # Garis grid ke-k yang dilewati: min(c0, c1) + 1 .. max(c0, c1)
+        k = np.minimum(c0, c1)[seg] + 1 + np.arange(len(seg)) - np.repeat(np.cumsum(crossings) - crossings, crossings)
+        t_parts.append((k * size - a0[seg]) / (a1[seg] - a0[seg]))
+        seg_parts.append(seg)
+
+    t, seg = np.concatenate(t_parts), np.concatenate(seg_parts)
+    order = np.lexsort((t, seg))
+    t, seg = t[order], seg[order]
+    px = x0[seg] + (x1[seg] - x0[seg]) * t
+    py = y0[seg] + (y1[seg] - y0[seg]) * t
+    same_seg = seg[1:] == seg[:-1]
+    return px[:-1][same_seg], py[:-1][same_seg], px[1:][same_seg], py[1:][same_seg], seg[:-1][same_seg]
+
+def build_density_grid(gdf, levels=DENSITY_GRID_LEVELS):
+    """Agregasi jumlah feature & meter kabel per cell (spec_id, asset_owner) untuk tiap level grid"""
+    try:
+        if gdf is None or gdf.empty:
+            return {}
+        gdf = gdf.set_crs("EPSG:4326") if gdf.crs is None else gdf.to_crs("EPSG:4326")
+
+        descriptions = gdf['description'] if 'description' in gdf.columns else pd.Series(None, index=gdf.index)
+        attrs = [parse_description(d) for d in descriptions]
+        spec_ids = np.array([a.get('spec_id') or 'unset' for a in attrs], dtype=object)
+        owners = np.array([a.get('asset_owner') or 'unset' for a in attrs], dtype=object)
+
+        # Jumlah feature dihitung sekali di cell titik wakilnya
+        points = gdf.geometry.representative_point()
+        base = pd.DataFrame({
+            'lon': points.x.values,
+            'lat': points.y.values,
+            'spec_id': spec_ids,
+            'asset_owner': owners
+        })
+
+        is_line = gdf.geometry.type.isin(['LineString', 'MultiLineString']).values
+        x0, y0, x1, y1, segment_line = _line_segments(np.asarray(gdf.geometry.values[is_line]))
+        line_specs, line_owners = spec_ids[is_line], owners[is_line]
+
+        grid = {}
+        for size in levels:
+            counts = base.assign(
+                ix=np.floor(base['lon'] / size).astype(int),
+                iy=np.floor(base['lat'] / size).astype(int)
+            ).groupby(['ix', 'iy', 'spec_id', 'asset_owner'], as_index=False).agg(count=('lon', 'size'))
+
+            # Meter kabel: segmen dipotong di garis grid, panjang geodesic per potongan masuk ke cell-nya
+            cable = pd.DataFrame(columns=['ix', 'iy', 'spec_id', 'asset_owner', 'cable_m'])
+            if len(x0):
+                px0, py0, px1, py1, piece_segment = _split_segments_at_grid(x0, y0, x1, y1, size)
+                lengths = np.asarray(GEOD.inv(px0, py0, px1, py1)[2])
+                piece_line = segment_line[piece_segment]
+                touched = lengths > 0
+                cable = pd.DataFrame({
+                    'ix': np.floor((px0 + px1) / 2 / size).astype(int)[touched],
+                    'iy': np.floor((py0 + py1) / 2 / size).astype(int)[touched],
+                    'spec_id': line_specs[piece_line[touched]],
+                    'asset_owner': line_owners[piece_line[touched]],
+                    'cable_m': lengths[touched]
+                }).groupby(['ix', 'iy', 'spec_id', 'asset_owner'], as_index=False)['cable_m'].sum()
+
+            cells = counts.merge(cable, on=['ix', 'iy', 'spec_id', 'asset_owner'], how='outer')
+            cells['count'] = cells['count'].fillna(0).astype(int)
+            cells['cable_m'] = cells['cable_m'].fillna(0.0).astype(float)
+            grid[size] = cells
+        return grid
+
+    except Exception as e:
+        st.warning(f"Density grid gagal dibuat: {e}")
+        return {}
+
+def aggregate_density(grid_level, spec_filter=None, owner_filter=None):
+    """Total per cell setelah filter spec_id / asset_owner"""
+    cells = grid_level
+    if spec_filter:
+        cells = cells[cells['spec_id'].isin(spec_filter)]
+    if owner_filter:
+        cells = cells[cells['asset_owner'].isin(owner_filter)]
+    return cells.groupby(['ix', 'iy'], as_index=False)[['count', 'cable_m']].sum()
+
+def clip_density_cells(grid_level, size, bbox):
+    """Cell density yang berada di dalam viewport (min_lon, min_lat, max_lon, max_lat)"""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    in_view = (
+        grid_level['ix'].between(math.floor(min_lon / size), math.floor(max_lon / size))
+        & grid_level['iy'].between(math.floor(min_lat / size), math.floor(max_lat / size))
+    )
+    return grid_level[in_view]
+
+def get_map_viewport(map_state, center, zoom, width_px=1200, height_px=500):
+    """Zoom & bbox peta dari nilai terakhir st_folium; diperkirakan dari center/zoom sebelum peta pertama kali tampil"""
+    if map_state:
+        bounds = map_state.get('bounds') or {}
+        south_west, north_east = bounds.get('_southWest') or {}, bounds.get('_northEast') or {}
+        corners = [south_west.get('lng'), south_west.get('lat'), north_east.get('lng'), north_east.get('lat')]
+        if map_state.get('zoom') is not None and None not in corners:
+            return map_state['zoom'], tuple(corners)
+    lat, lon = center
+    lon_span = width_px / 256 * 360 / 2 ** zoom
+    lat_span = height_px / 256 * 360 / 2 ** zoom * math.cos(math.radians(lat))
+    return zoom, (lon - lon_span / 2, lat - lat_span / 2, lon + lon_span / 2, lat + lat_span / 2)
+
+def get_density_level(zoom):
+    """Pilih ukuran cell sesuai zoom peta"""
+    if zoom >= 14:
+        return DENSITY_GRID_LEVELS[0]
+    if zoom >= 11:
+        return DENSITY_GRID_LEVELS[1]
+    if zoom >= 8:
+        return DENSITY_GRID_LEVELS[2]
+    return DENSITY_GRID_LEVELS[3]
+
+def suggest_radius(grid, lat, lon, target=DENSITY_TARGET_FEATURES, max_km=50):
+    """Saran radius (km) agar pencarian radius mengembalikan kira-kira `target` features
+
+    Tanpa filter spec_id / asset_owner, karena pencarian radius juga tidak memakainya."""
+    if not grid:
+        return None, 0
+    size = min(grid)
+    cells = aggregate_density(grid[size])
+    if cells.empty:
+        return None, 0
+
+    # Jarak ke pusat cell (km, pendekatan equirectangular)
+    dx = ((cells['ix'].values + 0.5) * size - lon) * 111 * math.cos(math.radians(lat))
+    dy = ((cells['iy'].values + 0.5) * size - lat) * 111
+    dist = np.sqrt(dx ** 2 + dy ** 2)
+    order = np.argsort(dist)
+    dist_sorted = dist[order]
+    cum_count = np.cumsum(cells['count'].values[order])
+
+    # Estimasi jumlah features untuk tiap radius bulat 1..max_km, ambil yang pertama mencapai target
+    radii = np.arange(1, max_km + 1)
+    inside = np.searchsorted(dist_sorted, radii, side='right')
+    expected = np.where(inside > 0, cum_count[np.maximum(inside - 1, 0)], 0)
+    reached = np.nonzero(expected >= target)[0]
+    pos = reached[0] if len(reached) else len(radii) - 1
+    return int(radii[pos]), int(expected[pos])
+
+def create_density_geojson(cells, size):
+    """FeatureCollection kotak cell untuk overlay density"""
+    max_count = cells['count'].max() if not cells.empty else 1
+    features = []
+    for ix, iy, count, cable_m in cells[['ix', 'iy', 'count', 'cable_m']].itertuples(index=False):
+        west, south = ix * size, iy * size
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[[west, south], [west + size, south], [west + size, south + size], [west, south + size], [west, south]]]
+            },
+            'properties': {
+                'jumlah': int(count),
+                'kabel_m': round(float(cable_m)),
+                'opacity': round(0.15 + 0.6 * count / max_count, 2)
+            }
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def create_density_layer(density_geojson):
+    """FeatureGroup overlay density; ditambahkan dinamis lewat st_folium tanpa me-reload peta"""
+    layer = folium.FeatureGroup(name="Density")
+    if density_geojson['features']:
+        folium.GeoJson(
+            density_geojson,
+            style_function=lambda x: {
+                'fillColor': '#e6550d', 'color': '#e6550d', 'weight': 0.5,
+                'fillOpacity': x['properties']['opacity']
+            },
+            tooltip=folium.GeoJsonTooltip(fields=['jumlah', 'kabel_m'], aliases=['Features', 'Kabel (m)'])
+        ).add_to(layer)
+    return layer
+
 # UI Streamlit
 st.title("🚨 GIS KML Quick Response - ULTIMATE")
 st.markdown("**Semua data KML akan terbaca - Pilih lokasi dengan klik peta**")
@@ -522,12 +1541,27 @@ with st.sidebar:
     
     radius_km = st.slider("Radius Pencarian (km)", 1, 50, 10, key="radius_input")
     
+    st.subheader("🧭 Mode Pencarian")
+    search_mode = st.selectbox("Mode", options=["Radius", "Poligon", "Koridor"], index=0, key="search_mode")
+    area_upload = None
+    corridor_width_m = 50
+    area_btn = False
+    if search_mode == "Poligon":
+        st.info("Gambar poligon/rectangle di peta atau upload file area")
+        area_upload = st.file_uploader("Upload area (KML/KMZ/GeoJSON)", type=['kml', 'kmz', 'geojson', 'json'], key="area_upload")
+    elif search_mode == "Koridor":
+        st.info("Gambar polyline jalur galian di peta atau upload file polyline")
+        area_upload = st.file_uploader("Upload polyline (KML/KMZ/GeoJSON)", type=['kml', 'kmz', 'geojson', 'json'], key="area_upload")
+        corridor_width_m = st.slider("Lebar Koridor (m)", 10, 1000, 50, step=10, key="corridor_width")
+    if search_mode != "Radius":
+        area_btn = st.button("🗺️ Analisis Area", type="primary", use_container_width=True)
+    
     col1, col2 = st.columns(2)
     with col1:
         analyze_btn = st.button("🚀 Analisis Gangguan", type="primary", use_container_width=True)
     with col2:
         if st.button("🔄 Reset", use_container_width=True):
-            for key in ['analysis_done', 'gdf_nearby', 'gangguan_coords', 'map_click_data', 'last_click_coords']:
+            for key in ['analysis_done', 'gdf_nearby', 'gangguan_coords', 'map_click_data', 'last_click_coords', 'query_area', 'last_event_id', 'analysis_radius_km']:
                 if key in st.session_state:
                     st.session_state[key] = None
             st.rerun()
@@ -539,7 +1573,21 @@ with st.sidebar:
         st.rerun()
     
     st.markdown("---")
-    zoom_level = st.slider("Zoom Level Peta", 10, 18, 15, key="zoom_input")
+    zoom_level = st.slider("Zoom Level Peta", 5, 18, 15, key="zoom_input")
+
+    # Density overlay & saran radius
+    density_overlay = st.checkbox("🟧 Tampilkan Density Overlay", value=False, key="density_overlay")
+    density_spec_values = []
+    density_owner_values = []
+    if st.session_state.get('density_grid'):
+        finest = st.session_state.density_grid[min(st.session_state.density_grid)]
+        density_spec_values = sorted(finest['spec_id'].unique())
+        density_owner_values = sorted(finest['asset_owner'].unique())
+    density_spec = st.multiselect("Density: spec_id", options=density_spec_values, default=[], key="density_spec")
+    density_owner = st.multiselect("Density: asset_owner", options=density_owner_values, default=[], key="density_owner")
+    density_target = st.number_input("Target jumlah features (saran radius)", 1, 1000, DENSITY_TARGET_FEATURES, key="density_target")
+    st.checkbox("🎯 Radius otomatis (saran density grid)", value=False, key="auto_radius",
+                help="Radius dipilih dari density grid saat klik/analisis, sebelum pencarian dijalankan")
 
     # Folder selection (if available)
     folder_col = None
@@ -588,7 +1636,8 @@ with st.sidebar:
     if st.session_state.get('gdf_master') is not None:
         candidates = ['source_layer', 'source', 'layer', 'folder', 'layer_name']
         for c in candidates:
-            if c in st.session_state.gdf_master.columns:
+            # Kolom folder sudah punya filter sendiri di atas
+            if c in st.session_state.gdf_master.columns and c != folder_col:
                 source_col = c
                 try:
                     source_values = sorted([str(x) for x in st.session_state.gdf_master[c].dropna().unique()])
@@ -605,6 +1654,18 @@ with st.sidebar:
 if st.session_state.gdf_master is None:
     with st.spinner("🔄 MEMUAT DATA KML... Ini mungkin butuh beberapa detik..."):
         st.session_state.gdf_master = load_master_kml()
+        st.session_state.closure_assoc = None
+        st.session_state.density_grid = None
+
+# Asosiasi kabel-closure dihitung sekali per load
+if st.session_state.gdf_master is not None and st.session_state.closure_assoc is None:
+    with st.spinner("🔗 Membangun asosiasi kabel-closure..."):
+        st.session_state.closure_assoc = build_closure_cable_index(st.session_state.gdf_master)
+
+# Density grid dihitung sekali per load
+if st.session_state.gdf_master is not None and st.session_state.density_grid is None:
+    with st.spinner("🟧 Membangun density grid..."):
+        st.session_state.density_grid = build_density_grid(st.session_state.gdf_master)
 
 # Main content
 if st.session_state.gdf_master is not None and not st.session_state.gdf_master.empty:
@@ -622,18 +1683,35 @@ if st.session_state.gdf_master is not None and not st.session_state.gdf_master.e
     elif basemap == 'Satellite (Esri)':
         tiles = 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}'
 
+    # Overlay density hanya untuk cell di viewport, level dari zoom peta yang sebenarnya
+    density_layer = None
+    if density_overlay and st.session_state.density_grid:
+        map_zoom, map_bbox = get_map_viewport(
+            st.session_state.get('interactive_map'),
+            st.session_state.gangguan_coords or [-6.2, 106.8],
+            zoom_level
+        )
+        density_size = get_density_level(map_zoom)
+        density_cells = clip_density_cells(st.session_state.density_grid[density_size], density_size, map_bbox)
+        density_layer = create_density_layer(
+            create_density_geojson(aggregate_density(density_cells, density_spec, density_owner), density_size)
+        )
+
     interactive_map = create_interactive_map(
         st.session_state.gdf_nearby, 
         st.session_state.gangguan_coords, 
         zoom_level,
-        radius_km=radius_km,
-        tiles=tiles
+        radius_km=st.session_state.analysis_radius_km or radius_km,
+        tiles=tiles,
+        query_area=st.session_state.query_area,
+        draw_mode={'Poligon': 'polygon', 'Koridor': 'polyline'}.get(search_mode),
+        styles=st.session_state.kml_styles
     )
     
-    map_data = st_folium(interactive_map, width=1200, height=500, key="interactive_map")
+    map_data = st_folium(interactive_map, width=1200, height=500, key="interactive_map", feature_group_to_add=density_layer)
     
-    # Process map click
-    if map_data and map_data.get("last_clicked"):
+    # Process map click (hanya untuk mode radius, mode area memakai klik untuk menggambar)
+    if search_mode == "Radius" and map_data and map_data.get("last_clicked"):
         click_data = map_data["last_clicked"]
         current_click = (click_data['lat'], click_data['lng'])
         last_click = st.session_state.last_click_coords
@@ -643,39 +1721,36 @@ if st.session_state.gdf_master is not None and not st.session_state.gdf_master.e
             st.session_state.map_click_data = click_data
             
             with st.spinner("Memproses lokasi yang dipilih..."):
-                success = analyze_from_map_click(click_data, radius_km)
+                success = analyze_from_map_click(click_data, radius_km, source_col, folder_col)
                 if success:
                     st.success("✅ Analisis selesai!")
             st.rerun()
     
     # Manual analysis
     if analyze_btn:
-        st.session_state.analysis_done = True
-        st.session_state.gangguan_coords = [lat, lon]
-        
-        gangguan_point = Point(lon, lat)
-        
-        with st.spinner(f"Mencari features dalam radius {radius_km} km..."):
-            st.session_state.gdf_nearby = filter_features_nearby(
-                st.session_state.gdf_master, 
-                gangguan_point, 
-                radius_km
-            )
-        # apply sidebar filters
-        try:
-            st.session_state.gdf_nearby = apply_filters(
-                st.session_state.gdf_nearby,
-                st.session_state.get('name_filter', ''),
-                st.session_state.get('name_list', []),
-                source_col,
-                st.session_state.get('source_filter', []),
-                folder_col_name=folder_col,
-                folder_filter_vals=st.session_state.get('folder_filter', [])
-            )
-        except Exception:
-            pass
+        analyze_radius(lat, lon, resolve_radius(lat, lon, radius_km), 'manual', source_col, folder_col)
         st.rerun()
     
+    # Area analysis (poligon / koridor)
+    if area_btn:
+        area_geom = None
+        try:
+            if area_upload is not None:
+                area_geom = read_area_upload(area_upload)
+            elif map_data and map_data.get("last_active_drawing"):
+                area_geom = shape(map_data["last_active_drawing"]["geometry"])
+        except Exception as e:
+            st.error(f"Gagal membaca area: {e}")
+        
+        if area_geom is None or area_geom.is_empty:
+            st.warning("⚠️ Belum ada area. Gambar di peta atau upload file terlebih dahulu.")
+        else:
+            if search_mode == "Koridor":
+                area_geom = build_corridor(area_geom, corridor_width_m)
+            st.session_state.map_click_data = None
+            if analyze_area(area_geom, source_col, folder_col):
+                st.rerun()
+    
     # Show click info
     if st.session_state.map_click_data:
         st.info(f"📍 **Lokasi terpilih dari peta:** Lat: {st.session_state.map_click_data['lat']:.6f}, Lon: {st.session_state.map_click_data['lng']:.6f}")
@@ -684,12 +1759,18 @@ if st.session_state.gdf_master is not None and not st.session_state.gdf_master.e
     if st.session_state.analysis_done and st.session_state.gangguan_coords:
         st.header(f"📊 Hasil Analisis Gangguan")
         
-        if st.session_state.map_click_data:
+        # Radius yang benar-benar dipakai gdf_nearby (bisa beda dari slider saat radius otomatis)
+        analysis_radius_km = st.session_state.analysis_radius_km or radius_km
+        
+        if st.session_state.query_area is not None:
+            st.write(f"**Sumber:** Area Poligon/Koridor | **Titik Tengah Area:** {st.session_state.gangguan_coords[0]:.6f}, {st.session_state.gangguan_coords[1]:.6f}")
+        elif st.session_state.map_click_data:
             st.write(f"**Sumber:** Klik Peta | **Lokasi:** {st.session_state.gangguan_coords[0]:.6f}, {st.session_state.gangguan_coords[1]:.6f}")
         else:
             st.write(f"**Sumber:** Input Manual | **Lokasi:** {st.session_state.gangguan_coords[0]:.6f}, {st.session_state.gangguan_coords[1]:.6f}")
         
-        st.write(f"**Radius:** {radius_km} km")
+        if st.session_state.query_area is None:
+            st.write(f"**Radius:** {analysis_radius_km} km")
         
         # Statistics
         col1, col2, col3, col4 = st.columns(4)
@@ -713,7 +1794,33 @@ if st.session_state.gdf_master is not None and not st.session_state.gdf_master.e
                 st.metric("Tipe Geometri", "0")
         
         with col4:
-            st.metric("Radius Pencarian", f"{radius_km} km")
+            if st.session_state.query_area is not None:
+                total_panjang = 0
+                if st.session_state.gdf_nearby is not None and 'panjang_potong_meter' in st.session_state.gdf_nearby.columns:
+                    total_panjang = st.session_state.gdf_nearby['panjang_potong_meter'].sum()
+                st.metric("Panjang Kabel di Area", f"{total_panjang:.0f} m")
+            else:
+                st.metric("Radius Pencarian", f"{analysis_radius_km} km")
+        
+        # Saran radius dari density grid (filter spec_id/asset_owner hanya untuk overlay)
+        if st.session_state.query_area is None and st.session_state.density_grid:
+            suggested_km, expected_count = suggest_radius(
+                st.session_state.density_grid,
+                st.session_state.gangguan_coords[0],
+                st.session_state.gangguan_coords[1],
+                target=density_target
+            )
+            if suggested_km is not None and suggested_km != analysis_radius_km:
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.info(f"💡 Saran radius: **{suggested_km} km** (± {expected_count} features untuk target {density_target})")
+                with col2:
+                    st.button(
+                        "Gunakan Saran Radius",
+                        on_click=apply_suggested_radius,
+                        args=(suggested_km, source_col, folder_col),
+                        use_container_width=True
+                    )
         
         # Results table
         if st.session_state.gdf_nearby is not None and not st.session_state.gdf_nearby.empty:
@@ -732,16 +1839,41 @@ if st.session_state.gdf_master is not None and not st.session_state.gdf_master.e
             
             st.dataframe(display_df[display_columns], use_container_width=True)
             
-            # Download
-            csv_data = display_df[display_columns].to_csv(index=False)
+            # Download (file baru dibuat saat tombol diklik)
+            export_gdf = display_df[display_columns + ['geometry']]
+            export_name = f"gangguan_{st.session_state.gangguan_coords[0]:.6f}_{st.session_state.gangguan_coords[1]:.6f}_{datetime.now().strftime('%H%M')}"
+            export_fmt = st.selectbox("Format Export", options=list(EXPORT_FORMATS.keys()), index=0, key="export_format")
+            ext, mime = EXPORT_FORMATS[export_fmt]
             st.download_button(
-                label="📥 Download Hasil Analisis (CSV)",
-                data=csv_data,
-                file_name=f"gangguan_{st.session_state.gangguan_coords[0]:.6f}_{st.session_state.gangguan_coords[1]:.6f}_{datetime.now().strftime('%H%M')}.csv",
-                mime="text/csv"
+                label=f"📥 Download Hasil Analisis ({export_fmt})",
+                data=lambda: export_layers([(export_name, export_gdf)], export_fmt),
+                file_name=f"{export_name}.{ext}",
+                mime=mime
             )
+        elif st.session_state.query_area is not None:
+            st.warning("⚠️ Tidak ada features ditemukan di dalam area poligon/koridor.")
         else:
-            st.warning(f"⚠️ Tidak ada features ditemukan dalam radius {radius_km} km.")
+            st.warning(f"⚠️ Tidak ada features ditemukan dalam radius {analysis_radius_km} km.")
+        
+        # Riwayat gangguan sebelumnya di sekitar lokasi / di dalam area
+        try:
+            if st.session_state.query_area is not None:
+                df_history = get_events_in_bounds(
+                    st.session_state.query_area.bounds,
+                    exclude_event_id=st.session_state.last_event_id
+                )
+            else:
+                df_history = get_events_nearby(
+                    st.session_state.gangguan_coords[0],
+                    st.session_state.gangguan_coords[1],
+                    analysis_radius_km,
+                    exclude_event_id=st.session_state.last_event_id
+                )
+            if not df_history.empty:
+                with st.expander(f"🕘 Riwayat Gangguan di Sekitar ({len(df_history)} kejadian)"):
+                    st.dataframe(df_history, use_container_width=True)
+        except Exception as e:
+            st.warning(f"Riwayat gangguan tidak tersedia: {e}")
     
     else:
         # Initial view
@@ -765,6 +1897,71 @@ if st.session_state.gdf_master is not None and not st.session_state.gdf_master.e
             if name_cols:
                 named_features = st.session_state.gdf_master[name_cols[0]].notna().sum()
                 st.metric("Features Bernama", named_features)
+    
+    # Asosiasi kabel-closure
+    assoc_table = st.session_state.closure_assoc['table'] if st.session_state.closure_assoc else pd.DataFrame()
+    if not assoc_table.empty:
+        with st.expander(f"🔗 Asosiasi Kabel - Closure ({len(assoc_table)} relasi)"):
+            st.dataframe(assoc_table, use_container_width=True)
+            st.download_button(
+                label="📥 Download Asosiasi Kabel-Closure (CSV)",
+                data=lambda: assoc_table.to_csv(index=False),
+                file_name="asosiasi_kabel_closure.csv",
+                mime="text/csv"
+            )
+    
+    # Batch export beberapa analisis dari riwayat
+    try:
+        df_recent = get_recent_events()
+    except Exception:
+        df_recent = pd.DataFrame()
+    if not df_recent.empty:
+        with st.expander("📦 Batch Export Analisis"):
+            event_labels = {
+                row['id']: f"#{row['id']} | {row['created_at']} | {row['lat']:.5f}, {row['lon']:.5f} | {row['feature_count']} features"
+                for _, row in df_recent.iterrows()
+            }
+            batch_events = st.multiselect("Pilih analisis", options=list(event_labels.keys()), format_func=event_labels.get, key="batch_events")
+            batch_fmt = st.selectbox("Format Export", options=list(EXPORT_FORMATS.keys()), index=0, key="batch_format")
+            st.caption("Jarak dihitung ulang dari titik analisis; kolom panjang_potong_meter (analisis area) tidak disertakan.")
+            if batch_events:
+                batch_master = st.session_state.gdf_master
+                batch_assoc = st.session_state.closure_assoc
+                event_coords = {row['id']: (row['lat'], row['lon']) for _, row in df_recent.iterrows()}
+
+                def build_batch_export():
+                    feature_ids = get_event_feature_ids(batch_events)
+                    layers = [
+                        (f"analisis_{event_id}", build_event_layer(batch_master, feature_ids[event_id], event_coords[event_id], batch_assoc))
+                        for event_id in batch_events
+                    ]
+                    return export_layers([(name, gdf) for name, gdf in layers if not gdf.empty], batch_fmt)
+
+                ext, mime = EXPORT_FORMATS[batch_fmt]
+                st.download_button(
+                    label=f"📥 Download {len(batch_events)} Analisis ({batch_fmt})",
+                    data=build_batch_export,
+                    file_name=f"batch_gangguan_{datetime.now().strftime('%Y%m%d_%H%M')}.{ext}",
+                    mime=mime
+                )
+    
+    # Hotspot gangguan berulang (query hanya jalan jika section dibuka)
+    st.header("📈 Hotspot Gangguan Berulang")
+    if st.checkbox("Tampilkan hotspot", value=False, key="show_hotspot"):
+        col1, col2 = st.columns(2)
+        with col1:
+            hotspot_group = st.selectbox("Kelompokkan per", options=["Kabel", "Span", "Grid Cell"], index=0, key="hotspot_group")
+        with col2:
+            hotspot_days = st.slider("Jendela Waktu (hari)", 1, 365, 30, key="hotspot_days")
+        
+        try:
+            df_hotspot = get_hotspots({'Kabel': 'kabel', 'Span': 'span', 'Grid Cell': 'grid'}[hotspot_group], hotspot_days)
+            if df_hotspot.empty:
+                st.info("Belum ada riwayat gangguan dalam jendela waktu ini.")
+            else:
+                st.dataframe(df_hotspot, use_container_width=True)
+        except Exception as e:
+            st.warning(f"Hotspot tidak tersedia: {e}")
 
 else:
     st.error("""
@@ -0,0 +1,257 @@
+"""Parser KML paralel: file di-split per batas Placemark lalu di-parse di process pool.
+
+Modul ini sengaja tidak meng-import streamlit supaya bisa di-load oleh worker
+process (spawn / forkserver) tanpa menjalankan UI app.
+"""
+import html
+import mmap
+import multiprocessing
+import os
+import re
+import xml.etree.ElementTree as ET
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+from shapely.geometry import (
+    Point, LineString, Polygon, MultiPoint, MultiLineString, MultiPolygon, GeometryCollection
+)
+
+# Chunk minimal per worker; file kecil di-parse langsung tanpa process pool
+MIN_CHUNK_BYTES = 4 * 1024 * 1024
+
+PLACEMARK_START = b'<Placemark'
+KML_ROOT_RE = re.compile(rb'<kml\b[^>]*>')
+PLACEMARK_RE = re.compile(rb'<Placemark\b.*?</Placemark>', re.S)
+STYLE_RE = re.compile(rb'<Style\b[^>]*>.*?</Style>', re.S)
+STYLEMAP_RE = re.compile(rb'<StyleMap\b[^>]*>.*?</StyleMap>', re.S)
+FOLDER_RE = re.compile(rb'<Folder\b[^>]*?(/?)>|</Folder>')
+FOLDER_CHILD_RE = re.compile(rb'<Folder\b|</Folder>|<Placemark\b')
+NAME_RE = re.compile(rb'<name>\s*(?:<!\[CDATA\[(.*?)\]\]>|([^<]*))\s*</name>', re.S)
+
+
+def _local_tag(elem):
+    return elem.tag.rsplit('}', 1)[-1]
+
+
+def _child_text(elem, tag):
+    child = elem.find('{*}' + tag)
+    if child is not None and child.text:
+        return child.text.strip()
+    return None
+
+
+def _parse_coords(text):
+    coords = []
+    for token in (text or '').split():
+        parts = token.split(',')
+        if len(parts) >= 2:
+            try:
+                coords.append((float(parts[0]), float(parts[1])))
+            except ValueError:
+                continue
+    return coords
+
+
+def _parse_geometry(placemark):
+    """Geometry Placemark (Point/LineString/Polygon, termasuk di dalam MultiGeometry)"""
+    parts = []
+    for elem in placemark.iter():
+        tag = _local_tag(elem)
+        if tag == 'Point':
+            coords = _parse_coords(_child_text(elem, 'coordinates'))
+            if coords:
+                parts.append(Point(coords[0]))
+        elif tag == 'LineString':
+            coords = _parse_coords(_child_text(elem, 'coordinates'))
+            if len(coords) > 1:
+                parts.append(LineString(coords))
+        elif tag == 'Polygon':
+            outer = elem.find('{*}outerBoundaryIs/{*}LinearRing/{*}coordinates')
+            shell = _parse_coords(outer.text if outer is not None else None)
+            if len(shell) > 2:
+                holes = []
+                for inner in elem.findall('{*}innerBoundaryIs/{*}LinearRing/{*}coordinates'):
+                    ring = _parse_coords(inner.text)
+                    if len(ring) > 2:
+                        holes.append(ring)
+                parts.append(Polygon(shell, holes))
+
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+
+    types = {p.geom_type for p in parts}
+    if types == {'Point'}:
+        return MultiPoint(parts)
+    if types == {'LineString'}:
+        return MultiLineString(parts)
+    if types == {'Polygon'}:
+        return MultiPolygon(parts)
+    return GeometryCollection(parts)
+
+
+def _parse_style(style, root_tag):
+    """Atribut ringkas dari elemen <Style>"""
+    elem = ET.fromstring(root_tag + style + b'</kml>')[0]
+    attrs = {}
+    line_style = elem.find('{*}LineStyle')
+    if line_style is not None:
+        attrs['line_color'] = _child_text(line_style, 'color')
+        attrs['line_width'] = _child_text(line_style, 'width')
+    poly_style = elem.find('{*}PolyStyle')
+    if poly_style is not None:
+        attrs['poly_color'] = _child_text(poly_style, 'color')
+    icon = elem.find('{*}IconStyle/{*}Icon')
+    if icon is not None:
+        attrs['icon_href'] = _child_text(icon, 'href')
+    return elem.get('id'), {k: v for k, v in attrs.items() if v is not None}
+
+
+def _parse_style_map(style_map, root_tag):
+    """StyleMap -> styleUrl untuk state 'normal'"""
+    elem = ET.fromstring(root_tag + style_map + b'</kml>')[0]
+    for pair in elem.findall('{*}Pair'):
+        if _child_text(pair, 'key') == 'normal':
+            return elem.get('id'), (_child_text(pair, 'styleUrl') or '').lstrip('#')
+    return elem.get('id'), None
+
+
+def _folder_name(mm, pos, end):
+    """<name> milik Folder: dicari sebelum child Folder/Placemark pertama"""
+    child = FOLDER_CHILD_RE.search(mm, pos, end)
+    match = NAME_RE.search(mm, pos, child.start() if child else end)
+    if not match:
+        return 'Unnamed'
+    raw = match.group(1) if match.group(1) is not None else match.group(2)
+    name = raw.decode('utf-8', 'replace').strip()
+    if match.group(1) is None:
+        name = html.unescape(name)
+    return name or 'Unnamed'
+
+
+def find_chunk_ranges(mm, n_chunks):
+    """Split file menjadi byte range yang selalu dimulai di awal <Placemark"""
+    size = len(mm)
+    boundaries = [0]
+    for i in range(1, n_chunks):
+        pos = mm.find(PLACEMARK_START, max(size * i // n_chunks, boundaries[-1] + 1))
+        if pos == -1:
+            break
+        if pos > boundaries[-1]:
+            boundaries.append(pos)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_chunk(file_path, start, end, root_tag):
+    """Parse satu byte range menjadi hasil kolomar (dipanggil di worker process)"""
+    result = {
+        'offset': [], 'id': [], 'name': [], 'description': [], 'styleUrl': [], 'wkb': [],
+        'folder_events': [], 'styles': {}, 'style_maps': {}
+    }
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for match in FOLDER_RE.finditer(mm, start, end):
+            if match.group(0).startswith(b'</'):
+                result['folder_events'].append((match.start(), None))
+            elif not match.group(1):
+                # <Folder .../> (self-closing) tidak punya isi, jadi dilewati
+                result['folder_events'].append((match.start(), _folder_name(mm, match.end(), end)))
+
+        for match in STYLE_RE.finditer(mm, start, end):
+            try:
+                style_id, attrs = _parse_style(match.group(0), root_tag)
+                if style_id:
+                    result['styles'][style_id] = attrs
+            except ET.ParseError:
+                continue
+
+        for match in STYLEMAP_RE.finditer(mm, start, end):
+            try:
+                map_id, target = _parse_style_map(match.group(0), root_tag)
+                if map_id and target:
+                    result['style_maps'][map_id] = target
+            except ET.ParseError:
+                continue
+
+        for match in PLACEMARK_RE.finditer(mm, start, end):
+            try:
+                placemark = ET.fromstring(root_tag + match.group(0) + b'</kml>')[0]
+            except ET.ParseError:
+                continue
+            geometry = _parse_geometry(placemark)
+            if geometry is None:
+                continue
+            result['offset'].append(match.start())
+            result['id'].append(placemark.get('id'))
+            result['name'].append(_child_text(placemark, 'name'))
+            result['description'].append(_child_text(placemark, 'description'))
+            result['styleUrl'].append(_child_text(placemark, 'styleUrl'))
+            result['wkb'].append(geometry.wkb)
+    return result
+
+
+def _folder_transitions(folder_events):
+    """Urutan (offset, folder stack) dari event buka/tutup Folder"""
+    offsets, stacks, stack = [0], [()], []
+    for offset, name in folder_events:
+        if name is None:
+            if stack:
+                stack.pop()
+        else:
+            stack.append(name)
+        offsets.append(offset)
+        stacks.append(tuple(stack))
+    return offsets, stacks
+
+
+def parse_kml_parallel(file_path, max_workers=None, min_chunk_bytes=MIN_CHUNK_BYTES):
+    """Parse KML besar secara paralel; return (GeoDataFrame, dict Style per id)
+
+    Folder path disimpan per feature, referensi Style tetap di kolom styleUrl.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        root_match = KML_ROOT_RE.search(mm, 0, min(len(mm), 64 * 1024))
+        root_tag = root_match.group(0) if root_match else b'<kml>'
+        n_chunks = max(1, min(max_workers, len(mm) // min_chunk_bytes))
+        ranges = find_chunk_ranges(mm, n_chunks)
+
+    if len(ranges) == 1:
+        partials = [parse_chunk(file_path, ranges[0][0], ranges[0][1], root_tag)]
+    else:
+        # forkserver: jangan fork dari thread script-runner Streamlit (risiko deadlock)
+        mp_context = multiprocessing.get_context('forkserver')
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(ranges)), mp_context=mp_context) as executor:
+            futures = [executor.submit(parse_chunk, file_path, start, end, root_tag) for start, end in ranges]
+            partials = [future.result() for future in futures]
+
+    # Merge hasil kolomar sesuai urutan chunk
+    columns = {key: [] for key in ['offset', 'id', 'name', 'description', 'styleUrl', 'wkb']}
+    folder_events, styles, style_maps = [], {}, {}
+    for partial in partials:
+        for key in columns:
+            columns[key].extend(partial[key])
+        folder_events.extend(partial['folder_events'])
+        styles.update(partial['styles'])
+        style_maps.update(partial['style_maps'])
+
+    for map_id, target in style_maps.items():
+        if target in styles:
+            styles[map_id] = styles[target]
+
+    # Folder path per Placemark dari posisi byte-nya
+    offsets, stacks = _folder_transitions(folder_events)
+    folder_stacks = [stacks[bisect_right(offsets, offset) - 1] for offset in columns['offset']]
+
+    gdf = gpd.GeoDataFrame({
+        'id': columns['id'],
+        'name': columns['name'],
+        'description': columns['description'],
+        'styleUrl': columns['styleUrl'],
+        'folder': [stack[-1] if stack else None for stack in folder_stacks],
+        'folder_path': ["/".join(stack) for stack in folder_stacks],
+    }, geometry=gpd.GeoSeries.from_wkb(columns['wkb'], crs="EPSG:4326"))
+    return gdf, styles